@@ -0,0 +1,78 @@
+"""
+Compares payload size and serialisation time of quote list responses.
+
+Run from the repository root with `python benchmarks/serialization.py [number of quotes]`.
+Loads quotefault_api/serialize.py directly, so no database, LDAP or config is needed.
+"""
+import importlib.util
+import json
+import os
+import random
+import string
+import sys
+import timeit
+
+from datetime import datetime, timedelta
+
+_SPEC = importlib.util.spec_from_file_location(
+    'serialize', os.path.join(os.path.dirname(__file__), '..', 'quotefault_api', 'serialize.py'))
+serialize = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(serialize)
+
+
+def _fake_quotes(count: int) -> list:
+    """
+    Builds dicts shaped like the output of return_quote_json
+    """
+    words = [''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(2, 9)))
+             for _ in range(2000)]
+    start = datetime(2015, 1, 1)
+    return [{
+        'id': index,
+        'quote': ' '.join(random.choice(words) for _ in range(random.randint(4, 25)))[:200],
+        'submitter': random.choice(words),
+        'speaker': random.choice(words),
+        'quoteTime': start + timedelta(minutes=index * 37),
+        'votes': random.randint(-5, 20),
+        'direction': 0,
+    } for index in range(count)]
+
+
+def _default_encoder(quotes: list) -> bytes:
+    """
+    Roughly what jsonify did before: datetimes rendered by the encoder's default hook
+    """
+    return json.dumps(quotes, separators=(',', ':'), default=serialize.http_date).encode('utf-8')
+
+
+def _prerendered(quotes: list, fields: tuple) -> list:
+    return [{field: (serialize.http_date(quote[field]) if field == 'quoteTime' else quote[field])
+             for field in fields} for quote in quotes]
+
+
+def main(count: int):
+    quotes = _fake_quotes(count)
+    projected = ('id', 'quote', 'speaker')
+    cases = [
+        ('default encoder, all fields', lambda: _default_encoder(quotes)),
+        ('stdlib, all fields', lambda: serialize.encode_json(_prerendered(quotes, serialize.QUOTE_FIELDS),
+                                                             fast=False)),
+        ('orjson, all fields', lambda: serialize.encode_json(_prerendered(quotes, serialize.QUOTE_FIELDS))),
+        ('stdlib, fields=id,quote,speaker', lambda: serialize.encode_json(_prerendered(quotes, projected),
+                                                                          fast=False)),
+        ('orjson, fields=id,quote,speaker', lambda: serialize.encode_json(_prerendered(quotes, projected))),
+    ]
+    if serialize.orjson is None:
+        print('orjson is not installed; the orjson rows fall back to the stdlib encoder')
+    print('{} quotes'.format(count))
+    print('{:<34}{:>12}{:>12}{:>12}{:>12}'.format('case', 'bytes', 'gzip bytes', 'encode ms', 'gzip ms'))
+    for name, encode in cases:
+        body = encode()
+        compressed = serialize.compress(body)
+        encode_ms = min(timeit.repeat(encode, number=5, repeat=3)) / 5 * 1000
+        gzip_ms = min(timeit.repeat(lambda: serialize.compress(body), number=5, repeat=3)) / 5 * 1000
+        print('{:<34}{:>12}{:>12}{:>12.2f}{:>12.2f}'.format(name, len(body), len(compressed), encode_ms, gzip_ms))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # Flask config
 DEBUG = True
@@ -16,6 +17,39 @@ SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///{
 # Do not use connections to the database older than 500 seconds
 SQLALCHEMY_POOL_RECYCLE = 500
 
+# Rate limiting: every API key gets a bucket of RATE_LIMIT_CAPACITY tokens refilled at
+# RATE_LIMIT_REFILL tokens per second. The buckets live in a sqlite file shared by all workers.
+RATE_LIMIT_DB = os.environ.get('API_QUOTEFAULT_RATE_LIMIT_DB',
+                               os.path.join(tempfile.gettempdir(), 'quotefault-ratelimit.db'))
+RATE_LIMIT_CAPACITY = float(os.environ.get('API_QUOTEFAULT_RATE_LIMIT_CAPACITY', 60))
+RATE_LIMIT_REFILL = float(os.environ.get('API_QUOTEFAULT_RATE_LIMIT_REFILL', 1))
+# Shed load once requests wait this many seconds (per X-Request-Start) for a worker
+SHED_QUEUE_LATENCY = float(os.environ.get('API_QUOTEFAULT_SHED_QUEUE_LATENCY', 0.5))
+
+# Responses: encode JSON with orjson when it's installed, and gzip bodies of at least
+# GZIP_MIN_SIZE bytes for clients that send Accept-Encoding: gzip
+FAST_JSON = os.environ.get('API_QUOTEFAULT_FAST_JSON', 'true').lower() == 'true'
+GZIP_MIN_SIZE = int(os.environ.get('API_QUOTEFAULT_GZIP_MIN_SIZE', 1024))
+
+# Server-sent events: events kept for Last-Event-ID resume, seconds between heartbeats,
+# and open streams allowed per worker. Every open stream occupies one of the worker's threads or
+# greenlets, so by default streams may use half of WORKER_CONCURRENCY (gunicorn's --threads or
+# --worker-connections). Sync workers have a concurrency of 1, which disables streams.
+WORKER_CONCURRENCY = int(os.environ.get('API_QUOTEFAULT_WORKER_CONCURRENCY', 1))
+SSE_REPLAY_SIZE = int(os.environ.get('API_QUOTEFAULT_SSE_REPLAY_SIZE', 256))
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get('API_QUOTEFAULT_SSE_HEARTBEAT_INTERVAL', 15))
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('API_QUOTEFAULT_SSE_MAX_SUBSCRIBERS', WORKER_CONCURRENCY // 2))
+
+# Serve the legacy filter routes from an in-memory index of the quote table. It is reloaded every
+# QUOTE_INDEX_TTL seconds, and whenever a probe every QUOTE_INDEX_PROBE_INTERVAL seconds sees the quote
+# revision counter bumped by another worker.
+QUOTE_INDEX = os.environ.get('API_QUOTEFAULT_QUOTE_INDEX', 'false').lower() == 'true'
+QUOTE_INDEX_TTL = float(os.environ.get('API_QUOTEFAULT_QUOTE_INDEX_TTL', 300))
+QUOTE_INDEX_PROBE_INTERVAL = float(os.environ.get('API_QUOTEFAULT_QUOTE_INDEX_PROBE_INTERVAL', 1))
+
+# Markov model shared by all workers, built by `flask build-markov`
+MARKOV_MODEL_PATH = os.environ.get('API_QUOTEFAULT_MARKOV_MODEL_PATH', os.path.join(os.getcwd(), 'markov.model'))
+
 # OpenID Connect SSO config
 OIDC_ISSUER = os.environ.get('API_QUOTEFAULT_OIDC_ISSUER', 'https://sso.csh.rit.edu/auth/realms/csh')
 OIDC_CLIENT_CONFIG = {
@@ -33,48 +33,85 @@ def parse(source):
         _parse_one(quote.lower())
 
 
-def _parse_one(quote):
+def _parse_one(quote, graph=None):
     """
-    Parses a single quote into the markov chain
+    Parses a single quote into the markov chain, or into graph if given
     """
+    if graph is None:
+        graph = _GRAPH
     # Remove punctuation and whitespace to make matching more likely
     words = list(word.translate(_TRANSLATE_TABLE).strip() for word in quote.split(' '))
 
     # Link every word to following words, and START -> beginning, end -> END
-    _GRAPH[_START].append(words[0])
+    graph[_START].append(words[0])
     for index, word in enumerate(words[:-1]):
-        if word not in _GRAPH:
-            _GRAPH[word] = []
-        _GRAPH[word].append(words[index + 1])
-    if words[-1] not in _GRAPH:
-        _GRAPH[words[-1]] = []
-    _GRAPH[words[-1]].append(_END)
+        if word not in graph:
+            graph[word] = []
+        graph[word].append(words[index + 1])
+    if words[-1] not in graph:
+        graph[words[-1]] = []
+    graph[words[-1]].append(_END)
 
 
-def generate():
+def generate(graph=None):
     """
-    Generates a quote based on the internal markov chain.
-    :raises: ValueError: if parsing has not occured and the internal chain is invalid
+    Generates a quote based on the internal markov chain, or on graph if given.
+    :raises: ValueError: if parsing has not occured and the chain is invalid
     """
+    if graph is None:
+        graph = _GRAPH
     # If not parsed, fail.
-    if not _GRAPH[_START]:
+    if not graph[_START]:
         raise ValueError("Please initilise the internal chain using parse()")
 
     # Walk through randomly selecting a following word until you hit an end
     out = []
     word = _START
-    word = random.choice(_GRAPH[word])
+    word = random.choice(graph[word])
     while word is not _END:
         out.append(word)
-        word = random.choice(_GRAPH[word])
+        word = random.choice(graph[word])
     return ' '.join(out)
 
 
-def generate_list(number):
+def generate_list(number, graph=None):
     """
     Returns a list of (length = number) quotes
     """
     out = []
     for _ in range(number):
-        out.append(generate())
+        out.append(generate(graph))
     return out
+
+
+class Chain:
+    """
+    A markov chain of its own, for callers that can't share the internal one,
+    e.g. concurrent requests in a threaded server
+    """
+
+    def __init__(self, source):
+        """
+        :param source: iterable of quotes
+        """
+        self._graph = {_START: []}
+        for quote in source:
+            _parse_one(quote.lower(), self._graph)
+
+    def generate(self):
+        """
+        Generates a quote based on this chain.
+        :raises: ValueError: if the chain was built from no quotes
+        """
+        return generate(self._graph)
+
+    def generate_list(self, number):
+        """
+        Returns a list of (length = number) quotes
+        """
+        return generate_list(number, self._graph)
+
+
+# pylint: disable=wrong-import-position
+from markov.model import build_model, load_model, MappedModel
+# pylint: enable=wrong-import-position
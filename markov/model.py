@@ -0,0 +1,146 @@
+"""
+Module markov.model.
+
+A prebuilt markov chain stored in a file that every process memory-maps read-only,
+so the chain is built once and its pages are shared instead of copied per worker.
+
+File layout, all integers unsigned 32 bit in native byte order:
+    header      magic, version, number of words, number of transitions, vocabulary size in bytes
+    offsets     words + 1 byte offsets of each word in the vocabulary
+    rows        words + 1 indices into transitions; word i's followers are transitions[rows[i]:rows[i + 1]]
+    transitions word ids, repeated as often as the pair occurs in the corpus
+    vocabulary  every word, UTF-8 encoded, back to back
+Word 0 is the start of a quote and word 1 the end.
+"""
+
+import mmap
+import os
+import random
+import struct
+import tempfile
+
+from array import array
+
+from markov import _START, _END, _parse_one
+
+_MAGIC = b'QFMC'
+# Also catches files built with the other byte order, where it reads as 0x01000000
+_VERSION = 1
+_HEADER = struct.Struct('=4sIIII')
+_START_ID = 0
+_END_ID = 1
+
+_loaded = {}
+
+
+def build_model(source, path):
+    """
+    Builds a markov chain from a list of quotes and atomically replaces the file at path with it
+    :param source: iterable of quotes
+    :param path: where to write the model
+    """
+    graph = {_START: []}
+    for quote in source:
+        _parse_one(quote.lower(), graph)
+
+    words = [_START, _END] + [word for word in graph if word is not _START]
+    ids = {word: index for index, word in enumerate(words)}
+
+    offsets = array('I', [0])
+    rows = array('I', [0])
+    transitions = array('I')
+    vocabulary = bytearray()
+    for word in words:
+        vocabulary += word.encode('utf-8')
+        offsets.append(len(vocabulary))
+        transitions.extend(ids[follower] for follower in graph.get(word, ()))
+        rows.append(len(transitions))
+
+    # Write next to the destination and rename over it, so readers only ever see a complete file
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.markov-')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            out.write(_HEADER.pack(_MAGIC, _VERSION, len(words), len(transitions), len(vocabulary)))
+            offsets.tofile(out)
+            rows.tofile(out)
+            transitions.tofile(out)
+            out.write(vocabulary)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class MappedModel:
+    """
+    A markov chain read straight out of a memory-mapped model file
+    """
+
+    def __init__(self, path):
+        """
+        :raises: ValueError: if the file is empty, truncated, or not a model built on this platform
+        """
+        with open(path, 'rb') as model_file:
+            self._map = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError("{} is too short to be a markov model".format(path))
+        magic, version, words, transitions, vocabulary = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("{} is not a markov model built on this platform".format(path))
+        if len(self._map) != _HEADER.size + 4 * (2 * (words + 1) + transitions) + vocabulary:
+            raise ValueError("{} is truncated".format(path))
+
+        view = memoryview(self._map)
+        position = _HEADER.size
+        self._offsets = view[position:position + 4 * (words + 1)].cast('I')
+        position += 4 * (words + 1)
+        self._rows = view[position:position + 4 * (words + 1)].cast('I')
+        position += 4 * (words + 1)
+        self._transitions = view[position:position + 4 * transitions].cast('I')
+        position += 4 * transitions
+        self._vocabulary = view[position:position + vocabulary]
+
+    def _word(self, word_id):
+        return str(self._vocabulary[self._offsets[word_id]:self._offsets[word_id + 1]], 'utf-8')
+
+    def _follow(self, word_id):
+        return self._transitions[random.randrange(self._rows[word_id], self._rows[word_id + 1])]
+
+    def generate(self):
+        """
+        Generates a quote based on the model.
+        :raises: ValueError: if the model was built from no quotes
+        """
+        if self._rows[_START_ID] == self._rows[_START_ID + 1]:
+            raise ValueError("The markov model is empty")
+
+        out = []
+        word_id = self._follow(_START_ID)
+        while word_id != _END_ID:
+            out.append(self._word(word_id))
+            word_id = self._follow(word_id)
+        return ' '.join(out)
+
+    def generate_list(self, number):
+        """
+        Returns a list of (length = number) quotes
+        """
+        return [self.generate() for _ in range(number)]
+
+
+def load_model(path):
+    """
+    Returns the model at path, mapping it again whenever the file has been replaced
+    :raises: FileNotFoundError: if no model has been built at path
+    :raises: ValueError: if the file at path isn't a usable model
+    """
+    stat = os.stat(path)
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    loaded = _loaded.get(path)
+    if loaded is None or loaded[0] != key:
+        loaded = (key, MappedModel(path))
+        # Requests still using the previous model keep its mapping alive until they finish
+        _loaded[path] = loaded
+    return loaded[1]
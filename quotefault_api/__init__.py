@@ -22,8 +22,11 @@ app.secret_key = 'submission'
 from quotefault_api.routes.legacy import legacy
 from quotefault_api.routes.members import members
 from quotefault_api.routes.quotes import quotes
+from quotefault_api.routes.stats import stats
+from quotefault_api import commands  # pylint: disable=unused-import
 # pylint: enable=wrong-import-position
 
 app.register_blueprint(legacy)
 app.register_blueprint(members, url_prefix='/members')
 app.register_blueprint(quotes, url_prefix='/quotes')
+app.register_blueprint(stats, url_prefix='/stats')
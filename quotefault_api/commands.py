@@ -0,0 +1,75 @@
+""" Quotefault - commands.py
+Maintenance commands, run with `flask <command>`
+"""
+import click
+import markov
+from sqlalchemy import inspect
+
+from quotefault_api import app
+from quotefault_api.models import db, Quote, quote_fingerprint
+from quotefault_api.stats import rebuild_stats
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """
+    Recomputes the stats rollups from the quote and vote tables
+    """
+    db.create_all()
+    rebuild_stats()
+    click.echo('Stats rebuilt')
+
+
+@app.cli.command('backfill-fingerprints')
+@click.option('--batch-size', default=500, help='Quotes to fingerprint per transaction')
+def backfill_fingerprints_command(batch_size: int):
+    """
+    Adds the quote fingerprint column and its unique index if they're missing, then fingerprints
+    every quote without one. Quotes that collide with an earlier quote are reported and left
+    without a fingerprint.
+    """
+    inspector = inspect(db.engine)
+    if 'fingerprint' not in [column['name'] for column in inspector.get_columns('quote')]:
+        db.engine.execute('ALTER TABLE quote ADD COLUMN fingerprint VARCHAR(64)')
+        click.echo('Added quote.fingerprint')
+
+    seen = dict(db.session.query(Quote.fingerprint, Quote.id).filter(Quote.fingerprint.isnot(None)))
+    collisions = []
+    filled = 0
+    last_id = 0
+    while True:
+        batch = Quote.query.filter(Quote.fingerprint.is_(None), Quote.id > last_id) \
+            .order_by(Quote.id).limit(batch_size).all()
+        if not batch:
+            break
+        for quote in batch:
+            fingerprint = quote_fingerprint(quote.quote)
+            if fingerprint in seen:
+                collisions.append((quote.id, seen[fingerprint]))
+            else:
+                seen[fingerprint] = quote.id
+                quote.fingerprint = fingerprint
+                filled += 1
+        last_id = batch[-1].id
+        db.session.commit()
+
+    existing = [index['name'] for index in inspector.get_indexes('quote')]
+    for index in Quote.__table__.indexes:
+        if index.name not in existing:
+            index.create(db.engine)
+            click.echo('Created index {}'.format(index.name))
+
+    click.echo('Fingerprinted {} quotes'.format(filled))
+    for quote_id, original_id in collisions:
+        click.echo('Quote {} duplicates quote {}'.format(quote_id, original_id))
+    click.echo('{} collisions'.format(len(collisions)))
+
+
+@app.cli.command('build-markov')
+def build_markov_command():
+    """
+    Builds the markov model shared by all workers from every quote, replacing the old one
+    """
+    quotes = (quote for (quote,) in db.session.query(Quote.quote).yield_per(1000))
+    markov.build_model(quotes, app.config['MARKOV_MODEL_PATH'])
+    click.echo('Markov model written to {}'.format(app.config['MARKOV_MODEL_PATH']))
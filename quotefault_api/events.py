@@ -0,0 +1,133 @@
+""" Quotefault - events.py
+In-process publish/subscribe bus feeding the server-sent events streams.
+Each worker has its own bus, so a stream sees the writes handled by its worker.
+"""
+import os
+import queue
+import threading
+import time
+
+from collections import deque
+from flask import Response, request
+
+from quotefault_api import app
+from quotefault_api.models import db
+from quotefault_api.serialize import encode_json
+
+
+class SubscriberLimitReached(Exception):
+    pass
+
+
+class EventBus:
+    """
+    Fans events out to subscriber queues and keeps the most recent ones in a ring
+    buffer so reconnecting clients can resume from their Last-Event-ID.
+    """
+
+    def __init__(self, replay_size: int, max_subscribers: int):
+        # Event ids are '<boot>-<seq>', so ids from another worker or a previous run are recognisable
+        self._boot = '{:x}{:x}'.format(os.getpid(), int(time.time()))
+        self._seq = 0
+        self._replay = deque(maxlen=replay_size)
+        self._subscribers = set()
+        self._max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+
+    def publish(self, event: str, data: dict):
+        """
+        Sends an event to every subscriber
+        :param event: The event type, e.g. 'created'
+        :param data: JSON-serialisable payload
+        """
+        with self._lock:
+            self._seq += 1
+            message = ('{}-{}'.format(self._boot, self._seq), event, encode_json(data).decode('utf-8'))
+            self._replay.append(message)
+            for subscriber in list(self._subscribers):
+                if subscriber.qsize() >= self._replay.maxlen:
+                    # Too slow to keep up; close its stream and let it resume from the replay buffer
+                    self._subscribers.discard(subscriber)
+                    subscriber.put_nowait(None)
+                else:
+                    subscriber.put_nowait(message)
+
+    def subscribe(self, last_event_id=None) -> queue.Queue:
+        """
+        Registers a new subscriber
+        :param last_event_id: The last event the client saw, if it is resuming
+        :return: A queue receiving (id, event, data) tuples, primed with any events missed since last_event_id.
+        None in the queue means the stream should end.
+        :raises: SubscriberLimitReached: if this worker is already serving the maximum number of streams
+        """
+        with self._lock:
+            if len(self._subscribers) >= self._max_subscribers:
+                raise SubscriberLimitReached()
+            subscriber = queue.Queue()
+            for message in self._missed(last_event_id):
+                subscriber.put_nowait(message)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _missed(self, last_event_id) -> list:
+        """
+        :param last_event_id: The last event id a client saw, or None
+        :return: The buffered events after it. Everything buffered if the id is from another worker or too old.
+        """
+        if not last_event_id:
+            return []
+        boot, _, seq = last_event_id.partition('-')
+        if boot != self._boot or not seq.isdigit():
+            return list(self._replay)
+        seq = int(seq)
+        return [message for message in self._replay if int(message[0].rsplit('-', 1)[1]) > seq]
+
+
+def stream(subscriber: queue.Queue):
+    """
+    Formats a subscriber's events as a text/event-stream, sending a comment as a
+    heartbeat whenever nothing has happened for SSE_HEARTBEAT_INTERVAL seconds
+    :param subscriber: Queue returned by EventBus.subscribe
+    :return: Generator of event-stream chunks
+    """
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                message = subscriber.get(timeout=app.config['SSE_HEARTBEAT_INTERVAL'])
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if message is None:
+                return
+            yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(*message)
+    finally:
+        bus.unsubscribe(subscriber)
+
+
+def event_stream_response() -> Response:
+    """
+    Subscribes the current request to the bus, resuming from its Last-Event-ID header
+    :return: A text/event-stream response, or 503 if this worker has no streams to spare. Each stream ties
+    up one of the worker's threads or greenlets until the client disconnects, which is why the number of
+    them is capped below the worker's concurrency.
+    """
+    try:
+        subscriber = bus.subscribe(request.headers.get('Last-Event-ID'))
+    except SubscriberLimitReached:
+        return "Too many open streams, try again later", 503, {'Retry-After': '30'}
+    # The stream needs no request context or database, so give back the connection check_key or the
+    # login used now rather than holding it from the pool for as long as the client stays connected
+    db.session.remove()
+    response = Response(stream(subscriber), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The generator's cleanup never runs if the client leaves before the first chunk
+    response.call_on_close(lambda: bus.unsubscribe(subscriber))
+    return response
+
+
+bus = EventBus(app.config['SSE_REPLAY_SIZE'], app.config['SSE_MAX_SUBSCRIBERS'])
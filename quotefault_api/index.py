@@ -0,0 +1,227 @@
+""" Quotefault - index.py
+Optional read-through, in-memory index of the quote table for the legacy filter routes.
+
+Rows live in parallel column arrays. Speakers and submitters map to posting lists of row
+positions, and a time-sorted array of positions answers quote_time ranges by bisection.
+Rows are never moved; deleted and edited rows are tombstoned and the index is rebuilt
+once tombstones make up half of it.
+
+Every quote write bumps the QuoteRevision counter in its own transaction. A worker applies its
+own writes to its index only when they are the very next revision, and otherwise, or when a
+probe finds the counter has moved, reloads. So writes by other workers, including edits, show
+up within QUOTE_INDEX_PROBE_INTERVAL.
+
+Speakers and submitters are compared the way the database compares them: exactly on sqlite and
+postgres, and ignoring case, accents and trailing spaces on MySQL, whose default _ci collations
+do. MySQL collations have more special cases than that, so results only match the database exactly
+on sqlite and postgres.
+"""
+import threading
+import time
+import unicodedata
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime
+
+from quotefault_api import app
+from quotefault_api.models import db, Quote, QuoteRevision, upsert_add
+
+IndexedQuote = namedtuple('IndexedQuote', ['id', 'submitter', 'quote', 'speaker', 'quote_time'])
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def bump_revision() -> int:
+    """
+    Counts a write to the quote table. Call in the same transaction as the write, before committing.
+    :return: The revision the write will have once committed
+    """
+    upsert_add(QuoteRevision, {'id': 1}, revision=1)
+    return current_revision()
+
+
+def current_revision() -> int:
+    """
+    :return: The number of writes made to the quote table
+    """
+    return db.session.query(QuoteRevision.revision).filter_by(id=1).scalar() or 0
+
+
+def _exact(name: str) -> str:
+    return name
+
+
+def _folded(name: str) -> str:
+    """
+    Approximates MySQL's default case and accent insensitive, PAD SPACE collations
+    """
+    if name is None:
+        return None
+    decomposed = unicodedata.normalize('NFKD', name.casefold().rstrip(' '))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _timestamp(date: datetime) -> float:
+    # quote_time is naive, so avoid datetime.timestamp() and its local timezone
+    return (date - _EPOCH).total_seconds()
+
+
+class QuoteIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+        self._loaded_at = 0.0
+        self._probed_at = 0.0
+        self._revision = None
+        self._key = _exact
+
+    def _clear(self):
+        self._ids = array('q')
+        self._quote_times = []
+        self._quotes = []
+        self._speakers = []
+        self._submitters = []
+        self._alive = bytearray()
+        self._positions = {}
+        self._by_speaker = {}
+        self._by_submitter = {}
+        # Row positions sorted by quote_time, with their timestamps alongside for bisecting
+        self._time_order = array('l')
+        self._time_keys = array('d')
+
+    def _append(self, quote):
+        position = len(self._ids)
+        timestamp = _timestamp(quote.quote_time)
+        self._ids.append(quote.id)
+        self._quote_times.append(quote.quote_time)
+        self._quotes.append(quote.quote)
+        self._speakers.append(quote.speaker)
+        self._submitters.append(quote.submitter)
+        self._alive.append(1)
+        self._positions[quote.id] = position
+        self._by_speaker.setdefault(self._key(quote.speaker), array('l')).append(position)
+        self._by_submitter.setdefault(self._key(quote.submitter), array('l')).append(position)
+        return position, timestamp
+
+    def _kill(self, quote_id: int) -> bool:
+        """
+        Tombstones a quote's row
+        :param quote_id: id of the quote
+        :return: True if the index was rebuilt because too many rows are dead
+        """
+        position = self._positions.pop(quote_id, None)
+        if position is not None:
+            self._alive[position] = 0
+        if len(self._positions) * 2 < len(self._alive):
+            self._load()
+            return True
+        return False
+
+    def _load(self):
+        """
+        Rebuilds the index from the quote table
+        """
+        self._clear()
+        self._key = _folded if db.engine.dialect.name == 'mysql' else _exact
+        # Read the revision first; a write committed before the rows are read only causes another reload
+        self._revision = current_revision()
+        rows = db.session.query(Quote.id, Quote.submitter, Quote.quote, Quote.speaker, Quote.quote_time) \
+            .order_by(Quote.id).all()
+        keyed = [self._append(IndexedQuote(*row)) for row in rows]
+        keyed.sort(key=lambda pair: pair[1])
+        self._time_order = array('l', (position for position, _ in keyed))
+        self._time_keys = array('d', (timestamp for _, timestamp in keyed))
+        self._loaded_at = self._probed_at = time.time()
+
+    def _refresh(self):
+        """
+        Reloads the index when it has expired, or when a probe of the revision shows another
+        worker has written to the quote table
+        """
+        now = time.time()
+        if now - self._loaded_at > app.config['QUOTE_INDEX_TTL']:
+            self._load()
+        elif now - self._probed_at > app.config['QUOTE_INDEX_PROBE_INTERVAL']:
+            self._probed_at = now
+            if current_revision() != self._revision:
+                self._load()
+
+    def _next_revision(self, revision: int) -> bool:
+        """
+        Checks that a write is the only one made since the index was last brought up to date,
+        reloading the index if it isn't
+        :param revision: The revision returned by bump_revision for the write
+        :return: True if the write should be applied to the index
+        """
+        if revision != self._revision + 1:
+            self._load()
+            return False
+        self._revision = revision
+        return True
+
+    def put(self, quote, revision: int):
+        """
+        Adds a quote to the index, replacing any earlier version of it
+        :param quote: A Quote that has been committed
+        :param revision: The revision returned by bump_revision for the write
+        """
+        with self._lock:
+            if not self._loaded_at or not self._next_revision(revision):
+                return
+            if self._kill(quote.id):
+                return
+            position, timestamp = self._append(quote)
+            index = bisect_right(self._time_keys, timestamp)
+            self._time_keys.insert(index, timestamp)
+            self._time_order.insert(index, position)
+
+    def remove(self, quote_id: int, revision: int):
+        """
+        Removes a deleted quote from the index
+        :param quote_id: id of the quote
+        :param revision: The revision returned by bump_revision for the delete
+        """
+        with self._lock:
+            if not self._loaded_at or not self._next_revision(revision):
+                return
+            self._kill(quote_id)
+
+    def find(self, start: datetime, end: datetime, submitter: str, speaker: str) -> list:
+        """
+        Finds quotes the same way query_builder(...).all() does
+        :param start: (optional) Start of the quote_time range, inclusive
+        :param end: End of the quote_time range, inclusive
+        :param submitter: (optional) The submitter, compared like the database's collation does
+        :param speaker: (optional) The speaker, compared like the database's collation does
+        :return: Matching quotes ordered by id
+        """
+        with self._lock:
+            self._refresh()
+            candidates = []
+            if start is not None:
+                low = bisect_left(self._time_keys, _timestamp(start))
+                high = bisect_right(self._time_keys, _timestamp(end))
+                candidates.append(self._time_order[low:high])
+            if submitter is not None:
+                candidates.append(self._by_submitter.get(self._key(submitter), ()))
+            if speaker is not None:
+                candidates.append(self._by_speaker.get(self._key(speaker), ()))
+
+            if candidates:
+                candidates.sort(key=len)
+                others = [set(positions) for positions in candidates[1:]]
+                positions = [position for position in candidates[0]
+                             if self._alive[position] and all(position in other for other in others)]
+            else:
+                positions = [position for position, alive in enumerate(self._alive) if alive]
+
+            positions.sort(key=self._ids.__getitem__)
+            return [IndexedQuote(self._ids[position], self._submitters[position], self._quotes[position],
+                                 self._speakers[position], self._quote_times[position])
+                    for position in positions]
+
+
+quote_index = QuoteIndex()
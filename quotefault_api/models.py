@@ -1,21 +1,57 @@
 import binascii
+import hashlib
 import os
 
 from datetime import datetime
 from sqlalchemy import UniqueConstraint
 from flask_sqlalchemy import SQLAlchemy
 
+from markov import _TRANSLATE_TABLE
 from quotefault_api import app
 
 db = SQLAlchemy(app)
 
 
+def upsert_add(model, key: dict, **amounts):
+    """
+    Adds to the columns of one row, creating it with the amounts if it doesn't exist yet. This is a
+    single upsert, so two workers creating the same row at the same time can't both insert it.
+    :param model: The model whose table holds the row
+    :param key: Primary key of the row
+    :param amounts: The amount to add to each column
+    """
+    table = model.__table__
+    values = dict(key, **amounts)
+    if db.engine.dialect.name == 'mysql':
+        conflict = 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+            '{0} = {0} + VALUES({0})'.format(column) for column in amounts)
+    else:
+        # sqlite >= 3.24 and postgres
+        conflict = 'ON CONFLICT ({}) DO UPDATE SET '.format(', '.join(key)) + ', '.join(
+            '{0} = {1}.{0} + excluded.{0}'.format(column, table.name) for column in amounts)
+    statement = db.text('INSERT INTO {} ({}) VALUES ({}) {}'.format(
+        table.name, ', '.join(values), ', '.join(':' + column for column in values), conflict))
+    statement = statement.bindparams(*(db.bindparam(column, type_=table.c[column].type) for column in values))
+    db.session.execute(statement, values)
+
+
+def quote_fingerprint(quote: str) -> str:
+    """
+    Hashes a quote ignoring case, punctuation and spacing, so near-duplicates collide
+    :param quote: the text of the quote
+    :return: hex sha256 of the normalised quote
+    """
+    normalised = ' '.join(quote.casefold().translate(_TRANSLATE_TABLE).split())
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+
+
 class Quote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     submitter = db.Column(db.String(80))
     quote = db.Column(db.String(200), unique=True)
     speaker = db.Column(db.String(50))
     quote_time = db.Column(db.DateTime)
+    fingerprint = db.Column(db.String(64), unique=True, index=True)
 
     # initialize a row for the Quote table
     def __init__(self, submitter, quote, speaker):
@@ -23,6 +59,19 @@ class Quote(db.Model):
         self.submitter = submitter
         self.quote = quote
         self.speaker = speaker
+        self.fingerprint = quote_fingerprint(quote)
+
+
+class QuoteRevision(db.Model):
+    """
+    A single row counting writes to the quote table, bumped in the same transaction as each write
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    revision = db.Column(db.Integer, default=0)
+
+    def __init__(self, revision):
+        self.id = 1
+        self.revision = revision
 
 
 class Vote(db.Model):
@@ -50,3 +99,40 @@ class APIKey(db.Model):
         self.hash = binascii.b2a_hex(os.urandom(10))
         self.owner = owner
         self.reason = reason
+
+
+class DailyStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    quotes = db.Column(db.Integer, default=0)
+    votes = db.Column(db.Integer, default=0)
+
+    def __init__(self, day, quotes, votes):
+        self.day = day
+        self.quotes = quotes
+        self.votes = votes
+
+
+class SpeakerStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    speaker = db.Column(db.String(50), primary_key=True)
+    quotes = db.Column(db.Integer, default=0)
+    votes = db.Column(db.Integer, default=0)
+
+    def __init__(self, day, speaker, quotes, votes):
+        self.day = day
+        self.speaker = speaker
+        self.quotes = quotes
+        self.votes = votes
+
+
+class SubmitterStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    submitter = db.Column(db.String(80), primary_key=True)
+    quotes = db.Column(db.Integer, default=0)
+    votes = db.Column(db.Integer, default=0)
+
+    def __init__(self, day, submitter, quotes, votes):
+        self.day = day
+        self.submitter = submitter
+        self.quotes = quotes
+        self.votes = votes
@@ -0,0 +1,157 @@
+""" Quotefault - ratelimit.py
+Per API key token buckets, shared between workers through a local sqlite file,
+and queue latency based load shedding.
+"""
+import math
+import sqlite3
+import threading
+import time
+
+from functools import wraps
+from flask import request
+
+from quotefault_api import app
+
+_SCHEMA = 'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+
+# Every bucket is full again after this many seconds, so older rows can be dropped
+_PRUNE_INTERVAL = 300
+
+if float(app.config['RATE_LIMIT_REFILL']) <= 0 or float(app.config['RATE_LIMIT_CAPACITY']) <= 0:
+    raise ValueError("RATE_LIMIT_REFILL and RATE_LIMIT_CAPACITY must be positive")
+
+_local = threading.local()
+_latency_lock = threading.Lock()
+_queue_latency = 0.0
+_last_prune = 0.0
+
+
+def _connection() -> sqlite3.Connection:
+    """
+    :return: This thread's connection to the bucket store, creating the table on first use
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(app.config['RATE_LIMIT_DB'], timeout=1, isolation_level=None)
+        # WAL keeps readers off the write lock, and NORMAL skips the fsync on every commit.
+        # Losing the last few bucket updates in a power cut is harmless.
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def take_tokens(key: str, cost: float) -> float:
+    """
+    Removes cost tokens from the bucket belonging to key, if it holds enough of them
+    :param key: API key the bucket belongs to
+    :param cost: Number of tokens the request costs
+    :return: 0 if the tokens were taken, otherwise the number of seconds until they will be available
+    """
+    global _last_prune
+    capacity = float(app.config['RATE_LIMIT_CAPACITY'])
+    rate = float(app.config['RATE_LIMIT_REFILL'])
+    now = time.time()
+    try:
+        conn = _connection()
+        # BEGIN IMMEDIATE takes the write lock up front so two workers can't both spend the same tokens
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = capacity
+            if row is not None:
+                tokens = min(capacity, row[0] + (now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            if now - _last_prune > _PRUNE_INTERVAL:
+                _last_prune = now
+                conn.execute('DELETE FROM bucket WHERE updated < ?', (now - capacity / rate,))
+            conn.execute('COMMIT')
+        except BaseException:
+            # Anything left uncommitted would keep holding the write lock for every worker
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error:
+        # Never turn a broken or contended store into an outage; let the request through
+        return 0.0
+    return wait
+
+
+def _observe_queue_latency() -> float:
+    """
+    Reads the X-Request-Start header set by the proxy and folds the time this request
+    spent waiting for a worker into a moving average
+    :return: The moving average of queue latency in seconds
+    """
+    global _queue_latency
+    header = request.headers.get('X-Request-Start')
+    if not header:
+        return _queue_latency
+    try:
+        start = float(header.replace('t=', ''))
+    except ValueError:
+        return _queue_latency
+    # Proxies send seconds, milliseconds or microseconds since the epoch
+    while start > 1e11:
+        start /= 1000
+    latency = max(0.0, time.time() - start)
+    with _latency_lock:
+        _queue_latency += (latency - _queue_latency) * 0.2
+        return _queue_latency
+
+
+def _should_shed(cost: float) -> bool:
+    """
+    Decides whether to drop a request because workers are falling behind.
+    Expensive requests are shed as soon as the queue latency passes the threshold,
+    cheap ones only once it is twice the threshold.
+    :param cost: Number of tokens the request costs
+    :return: True if the request should be rejected
+    """
+    threshold = float(app.config['SHED_QUEUE_LATENCY'])
+    latency = _observe_queue_latency()
+    if cost > 1:
+        return latency > threshold
+    return latency > 2 * threshold
+
+
+def rate_limit(cost=1):
+    """
+    Creates a decorator charging each request against the bucket of its API key.
+    Must wrap check_key, so rejected requests never reach the database.
+    :param cost: Tokens per request, or a function of the route's arguments returning them
+    :return: Decorator returning 429 or 503 with Retry-After when the request is refused, or 400 when
+    it costs more than a full bucket
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(api_key, *args, **kwargs):
+            price = cost(**kwargs) if callable(cost) else cost
+            if price > float(app.config['RATE_LIMIT_CAPACITY']):
+                # A bucket can never hold enough tokens, so waiting won't help
+                return "That request is too big, ask for less.", 400
+            if _should_shed(price):
+                return "Server is busy, try again later", 503, {'Retry-After': '1'}
+            wait = take_tokens(api_key, price)
+            if wait:
+                return "Slow down!", 429, {'Retry-After': str(int(math.ceil(wait)))}
+            return func(api_key, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def markov_cost(count) -> int:
+    """
+    :param count: Number of quotes requested from /markov/<count>
+    :return: Cost of generating that many quotes
+    """
+    try:
+        return 1 + max(0, int(count))
+    except ValueError:
+        return 1
@@ -3,6 +3,8 @@
 /<api_key>/random
 /<api_key>/newest
 /<api_key>/between
+/<api_key>/stream
+/<api_key>/stats
 /<api_key>/markov
 /generatekey/<reason>
 """
@@ -11,13 +13,19 @@ import random
 import markdown
 from flask import Blueprint, jsonify, request, json, redirect, url_for
 from flask_cors import cross_origin
+from sqlalchemy.exc import IntegrityError
 
 import markov
-from quotefault_api import auth
+from quotefault_api import app, auth
 from quotefault_api.models import db
 from quotefault_api.models import Quote, APIKey
+from quotefault_api.events import event_stream_response
+from quotefault_api.index import bump_revision
+from quotefault_api.stats import record_quote, stats_summary
+from quotefault_api.ratelimit import rate_limit, markov_cost
 from quotefault_api.utils import check_key, query_builder, parse_as_json, \
-    return_quote_json, get_metadata, check_key_unique
+    return_quote_json, get_metadata, check_key_unique, requested_fields, json_response, quote_committed, \
+    date_range, find_quotes, is_duplicate
 
 legacy = Blueprint('legacy', __name__)
 
@@ -31,6 +39,7 @@ def index():
 
 @legacy.route('/<api_key>/between/<start>/<limit>', methods=['GET'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(5)
 @check_key
 def between(start: str, limit: str):
     """
@@ -41,14 +50,15 @@ def between(start: str, limit: str):
     """
     submitter = request.args.get('submitter')
     speaker = request.args.get('speaker')
-    query = query_builder(start, limit, submitter, speaker)
-    if not query.all():
+    quotes = find_quotes(start, limit, submitter, speaker)
+    if not quotes:
         return "none"
-    return parse_as_json(query.all())
+    return parse_as_json(quotes, fields=requested_fields())
 
 
 @legacy.route('/<api_key>/create', methods=['PUT'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(1)
 @check_key
 def create_quote():
     """
@@ -68,15 +78,22 @@ def create_quote():
                    "and somehow you fucked them up.", 400
         if speaker == submitter:
             return "Quote someone else you narcissist.", 400
-        if Quote.query.filter(Quote.quote == quote).first() is not None:
+        if is_duplicate(quote):
             return "That quote has already been said, asshole", 400
         if len(quote) > 200:
             return "Quote is too long! This is no longer a quote, it's a monologue!", 400
         # Creates a new quote given the data from the body of the request
         new_quote = Quote(submitter=submitter, quote=quote, speaker=speaker)
         db.session.add(new_quote)
-        db.session.flush()
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return "That quote has already been said, asshole", 400
+        record_quote(new_quote)
+        revision = bump_revision()
         db.session.commit()
+        quote_committed('created', new_quote, revision)
         # Returns the json of the quote
         return jsonify(return_quote_json(new_quote)), 201
     return "You need to actually fill in your fields.", 400
@@ -84,6 +101,7 @@ def create_quote():
 
 @legacy.route('/<api_key>/all', methods=['GET'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(5)
 @check_key
 def all_quotes():
     """
@@ -93,14 +111,15 @@ def all_quotes():
     date = request.args.get('date')
     submitter = request.args.get('submitter')
     speaker = request.args.get('speaker')
-    query = query_builder(date, None, submitter, speaker)
-    if not query.all():
+    quotes = find_quotes(date, None, submitter, speaker)
+    if not quotes:
         return "none"
-    return parse_as_json(query.all())
+    return parse_as_json(quotes, fields=requested_fields())
 
 
 @legacy.route('/<api_key>/random', methods=['GET'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(1)
 @check_key
 def random_quote():
     """
@@ -110,15 +129,15 @@ def random_quote():
     date = request.args.get('date')
     submitter = request.args.get('submitter')
     speaker = request.args.get('speaker')
-    quotes = query_builder(date, None, submitter, speaker).all()
+    quotes = find_quotes(date, None, submitter, speaker)
     if not quotes:
         return "none"
-    random_index = random.randint(0, len(quotes))
-    return jsonify(return_quote_json(quotes[random_index]))
+    return json_response(return_quote_json(random.choice(quotes), fields=requested_fields()))
 
 
 @legacy.route('/<api_key>/newest', methods=['GET'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(1)
 @check_key
 def newest():
     """
@@ -129,14 +148,41 @@ def newest():
     date = request.args.get('date')
     submitter = request.args.get('submitter')
     speaker = request.args.get('speaker')
-    query = query_builder(date, None, submitter, speaker).order_by(Quote.id.desc())
-    if not query.all():
+    quotes = find_quotes(date, None, submitter, speaker)
+    if not quotes:
         return "none"
-    return jsonify(return_quote_json(query.first()))
+    return json_response(return_quote_json(max(quotes, key=lambda quote: quote.id), fields=requested_fields()))
+
+
+@legacy.route('/<api_key>/stream', methods=['GET'])
+@cross_origin(headers=['Content-Type', 'Last-Event-ID'])
+@rate_limit(1)
+@check_key
+def stream():
+    """
+    Streams created, updated and deleted quotes as server-sent events
+    :return: A text/event-stream response
+    """
+    return event_stream_response()
+
+
+@legacy.route('/<api_key>/stats', methods=['GET'])
+@cross_origin(headers=['Content-Type'])
+@rate_limit(1)
+@check_key
+def stats():
+    """
+    Summarises quotes and votes per day and month, with the top speakers and submitters
+    :return: Returns JSON of the summary, optionally limited to the range given by start and end
+    """
+    start, end = date_range(request.args.get('start'), request.args.get('end'))
+    limit = int(request.args.get('limit', 10))
+    return json_response(stats_summary(start, end, limit))
 
 
 @legacy.route('/<api_key>/<qid>', methods=['GET'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(1)
 @check_key
 def quote_id(qid: int):
     """
@@ -147,43 +193,61 @@ def quote_id(qid: int):
     query = query_builder(None, None, None, None, id_num=qid)
     if not query.all():
         return "none"
-    return jsonify(return_quote_json(query.first()))
+    return json_response(return_quote_json(query.first(), fields=requested_fields()))
+
+
+def _markov_chain(submitter: str, speaker: str):
+    """
+    Picks the markov chain to generate quotes from. Unfiltered requests use the model built by
+    `flask build-markov`, which all workers share; filtered ones build a chain of their own from the
+    matching quotes, since the markov module's internal chain would be shared with concurrent requests.
+    :param submitter: (optional) Only use quotes from this submitter
+    :param speaker: (optional) Only use quotes by this speaker
+    :return: The prebuilt model or a markov.Chain, both of which have generate() and generate_list()
+    """
+    if submitter is None and speaker is None:
+        try:
+            return markov.load_model(app.config['MARKOV_MODEL_PATH'])
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as error:
+            app.logger.warning("Can't use the markov model, building the chain instead: %s", error)
+    return markov.Chain(quote.quote for quote in query_builder(None, None, submitter, speaker).all())
 
 
 @legacy.route('/<api_key>/markov', methods=['GET'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(1)
 @check_key
 def markov_single():
     """
     Generates a quote using a markov chain, optionally constraining
     input to a speaker or submitter.
     """
-    submitter = request.args.get('submitter')
-    speaker = request.args.get('speaker')
-    query = query_builder(None, None, submitter, speaker)
-    if query.all() is None:
+    chain = _markov_chain(request.args.get('submitter'), request.args.get('speaker'))
+    try:
+        return jsonify(chain.generate())
+    except ValueError:
+        # No quotes to build the chain from
         return "none"
-    markov.reset()
-    markov.parse([quote.quote for quote in query.all()])
-    return jsonify(markov.generate())
 
 
 @legacy.route('/<api_key>/markov/<count>', methods=['GET'])
 @cross_origin(headers=['Content-Type'])
+@rate_limit(markov_cost)
 @check_key
 def markov_list(count: int):
     """
     Generates a list of quotes using a markov chain, optionally constraining
     input to a speaker or submitter.
     """
-    submitter = request.args.get('submitter')
-    speaker = request.args.get('speaker')
-    query = query_builder(None, None, submitter, speaker)
-    if query.all() is None:
+    number = int(count)
+    chain = _markov_chain(request.args.get('submitter'), request.args.get('speaker'))
+    try:
+        return jsonify(chain.generate_list(number))
+    except ValueError:
+        # No quotes to build the chain from
         return "none"
-    markov.reset()
-    markov.parse([quote.quote for quote in query.all()])
-    return jsonify(markov.generate_list(int(count)))
 
 
 @legacy.route('/generatekey/<reason>')
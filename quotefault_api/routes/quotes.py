@@ -1,15 +1,20 @@
 """ QuotefaultAPI - quotes.py
 /quotes
+/quotes/stream
 /quotes/<id>
 """
 
 from flask import Blueprint, jsonify, session, request
+from sqlalchemy.exc import IntegrityError
 
 from quotefault_api import auth
-from quotefault_api.models import db, Quote
+from quotefault_api.events import event_stream_response
+from quotefault_api.index import bump_revision
+from quotefault_api.models import db, Quote, quote_fingerprint
 from quotefault_api.ldap import ldap_is_rtp
+from quotefault_api.stats import record_quote, record_speaker_change
 from quotefault_api.utils import parse_as_json, flask_create_quote, return_quote_json, \
-    ldap_is_member
+    ldap_is_member, requested_fields, json_response, quote_committed, quote_deleted, is_duplicate
 
 quotes = Blueprint('quotes', __name__)
 
@@ -42,7 +47,7 @@ def quotes_route():  # pylint: disable=inconsistent-return-statements
             query = query.filter(Quote.submitter.ilike("%" + submitter + "%"))
 
         query = query[page_id * page_size: page_id + 1 * page_size]
-        return parse_as_json(query, current_user=current_user), 200
+        return parse_as_json(query, current_user=current_user, fields=requested_fields()), 200
     if request.method == 'POST':
         if request.content_type == 'application/json':
             data = request.get_json()
@@ -58,6 +63,16 @@ def quotes_route():  # pylint: disable=inconsistent-return-statements
         return flask_create_quote(submitter, speaker, quote)
 
 
+@quotes.route('/stream', methods=['GET'])
+@auth.oidc_auth
+def stream_route():
+    """
+    Streams created, updated and deleted quotes as server-sent events.
+    Send Last-Event-ID to resume after a disconnect.
+    """
+    return event_stream_response()
+
+
 @quotes.route('/<qid>', methods=['GET', 'PUT', 'DELETE'])
 @auth.oidc_auth
 def quote_route(qid: int):  # pylint: disable=inconsistent-return-statements,too-many-return-statements
@@ -74,7 +89,7 @@ def quote_route(qid: int):  # pylint: disable=inconsistent-return-statements,too
                         'message': 'quote doesn\'t exist'}), 404
 
     if request.method == 'GET':
-        return return_quote_json(quote, current_user=current_user), 200
+        return json_response(return_quote_json(quote, current_user=current_user, fields=requested_fields()))
 
     if not (current_user == quote.submitter or ldap_is_rtp(current_user)):
         return jsonify({'status': 'error',
@@ -91,21 +106,40 @@ def quote_route(qid: int):  # pylint: disable=inconsistent-return-statements,too
         else:
             return jsonify({'status': 'error',
                             'message': 'unsupported content-type'}), 415
+        if new_quote and is_duplicate(new_quote, quote_id=quote.id):
+            return jsonify({'status': 'error',
+                            'message': 'quote already exists'}), 422
         if speaker:
             if ldap_is_member(speaker):
+                old_speaker = quote.speaker
                 quote.speaker = speaker
+                if speaker != old_speaker:
+                    record_speaker_change(quote, old_speaker)
             else:
                 return jsonify({'status': 'error',
                                 'message': 'invalid speaker'}), 422
         if new_quote:
             quote.quote = new_quote
-        db.session.flush()
+            quote.fingerprint = quote_fingerprint(new_quote)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Someone else submitted the same quote since is_duplicate looked
+            db.session.rollback()
+            return jsonify({'status': 'error',
+                            'message': 'quote already exists'}), 422
+        revision = bump_revision()
         db.session.commit()
+        quote_committed('updated', quote, revision)
         return return_quote_json(quote, current_user=current_user), 201
 
     if request.method == 'DELETE':
+        deleted = quote.id
+        record_quote(quote, sign=-1)
         Quote.query.filter_by(id=qid).delete()
         db.session.flush()
+        revision = bump_revision()
         db.session.commit()
+        quote_deleted(deleted, revision)
         return jsonify({'status': 'success',
                         'message': 'quote successfully deleted'}), 201
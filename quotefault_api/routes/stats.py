@@ -0,0 +1,24 @@
+""" QuotefaultAPI - stats.py
+/stats
+"""
+
+from flask import Blueprint, request
+
+from quotefault_api import auth
+from quotefault_api.stats import stats_summary
+from quotefault_api.utils import date_range, json_response
+
+stats = Blueprint('stats', __name__)
+
+
+@stats.route('/', methods=['GET'])
+@auth.oidc_auth
+def stats_route():
+    """
+    Summarises quotes and votes per day and month, with the top speakers and submitters.
+    Takes optional start and end dates, in the same formats as the legacy date parameters,
+    and a limit on the number of top speakers and submitters.
+    """
+    start, end = date_range(request.args.get('start'), request.args.get('end'))
+    limit = int(request.args.get('limit', 10))
+    return json_response(stats_summary(start, end, limit))
@@ -0,0 +1,61 @@
+""" Quotefault - serialize.py
+JSON encoding and compression helpers. Only depends on the standard library
+(and orjson, when installed) so it can be benchmarked on its own.
+"""
+import calendar
+import gzip
+import json
+
+from datetime import datetime
+from email.utils import formatdate
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+QUOTE_FIELDS = ('id', 'quote', 'submitter', 'speaker', 'quoteTime', 'votes', 'direction')
+VOTE_FIELDS = ('votes', 'direction')
+
+
+def parse_fields(fields: str) -> tuple:
+    """
+    Parses the value of a ?fields= parameter
+    :param fields: Comma separated list of field names, or None
+    :return: The known fields requested, in their usual order. All fields if none were requested.
+    """
+    if not fields:
+        return QUOTE_FIELDS
+    requested = {field.strip() for field in fields.split(',')}
+    return tuple(field for field in QUOTE_FIELDS if field in requested) or QUOTE_FIELDS
+
+
+def http_date(date: datetime) -> str:
+    """
+    Formats a datetime the same way Flask's default JSON encoder does
+    :param date: the datetime, or None
+    :return: e.g. 'Fri, 27 Oct 2017 22:14:31 GMT'
+    """
+    if date is None:
+        return None
+    return formatdate(calendar.timegm(date.utctimetuple()), usegmt=True)
+
+
+def encode_json(obj, fast=True) -> bytes:
+    """
+    Encodes obj as compact JSON
+    :param obj: A JSON-serialisable object
+    :param fast: Use orjson if it is installed
+    :return: The UTF-8 encoded JSON
+    """
+    if fast and orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def compress(body: bytes) -> bytes:
+    """
+    :param body: Response body
+    :return: The body gzipped at a level that favours speed over size
+    """
+    return gzip.compress(body, compresslevel=5)
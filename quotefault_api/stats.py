@@ -0,0 +1,104 @@
+""" Quotefault - stats.py
+Rollups of quote counts and vote sums per day, per speaker per day and per submitter per day.
+Quote counts are updated in the same transaction as the writes they count. Vote sums are only
+computed by `flask rebuild-stats`, which also recomputes the counts from scratch.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+from quotefault_api.models import db, Quote, Vote, DailyStat, SpeakerStat, SubmitterStat, upsert_add
+
+
+def _adjust(model, key: dict, quotes: int):
+    """
+    Adds to the quote count of one rollup row, creating it if it doesn't exist yet.
+    Vote sums are left alone; only rebuild_stats sets them.
+    :param model: The rollup model
+    :param key: Primary key of the row
+    :param quotes: Change in number of quotes
+    """
+    upsert_add(model, key, quotes=quotes, votes=0)
+
+
+def record_quote(quote: Quote, sign=1):
+    """
+    Counts a new quote, or uncounts a deleted one. Call before committing the write.
+    :param quote: The quote being added or removed
+    :param sign: 1 when adding the quote, -1 when removing it
+    """
+    day = quote.quote_time.date()
+    _adjust(DailyStat, {'day': day}, sign)
+    _adjust(SpeakerStat, {'day': day, 'speaker': quote.speaker}, sign)
+    _adjust(SubmitterStat, {'day': day, 'submitter': quote.submitter}, sign)
+
+
+def record_speaker_change(quote: Quote, old_speaker: str):
+    """
+    Moves a quote from one speaker's rollup to another's. Call before committing the write.
+    :param quote: The quote, with its new speaker set
+    :param old_speaker: The speaker the quote used to have
+    """
+    day = quote.quote_time.date()
+    _adjust(SpeakerStat, {'day': day, 'speaker': old_speaker}, -1)
+    _adjust(SpeakerStat, {'day': day, 'speaker': quote.speaker}, 1)
+
+
+def rebuild_stats():
+    """
+    Recomputes every rollup from the quote and vote tables and commits the result
+    """
+    votes = dict(db.session.query(Vote.quote_id, db.func.sum(Vote.direction)).group_by(Vote.quote_id))
+    daily, speakers, submitters = {}, {}, {}
+    for quote in Quote.query.yield_per(1000):
+        day = quote.quote_time.date()
+        for rollup, key in ((daily, day), (speakers, (day, quote.speaker)), (submitters, (day, quote.submitter))):
+            counts = rollup.setdefault(key, [0, 0])
+            counts[0] += 1
+            counts[1] += votes.get(quote.id) or 0
+
+    DailyStat.query.delete()
+    SpeakerStat.query.delete()
+    SubmitterStat.query.delete()
+    db.session.add_all(DailyStat(day, *counts) for day, counts in daily.items())
+    db.session.add_all(SpeakerStat(day, speaker, *counts) for (day, speaker), counts in speakers.items())
+    db.session.add_all(SubmitterStat(day, submitter, *counts) for (day, submitter), counts in submitters.items())
+    db.session.commit()
+
+
+def _top(model, column, start: datetime, end: datetime, limit: int) -> list:
+    query = db.session.query(column, db.func.sum(model.quotes), db.func.sum(model.votes))
+    if start is not None:
+        query = query.filter(model.day >= start.date(), model.day < end.date())
+    query = query.group_by(column).order_by(db.func.sum(model.quotes).desc(), column).limit(limit)
+    return [{column.key: name, 'quotes': int(quotes), 'votes': int(votes)} for name, quotes, votes in query]
+
+
+def stats_summary(start: datetime, end: datetime, limit: int) -> dict:
+    """
+    Summarises the rollups between two days
+    :param start: (optional) Start of the range. Everything is summarised if it's None.
+    :param end: The end of the range, exclusive
+    :param limit: The number of top speakers and submitters to return
+    :return: Totals, quotes and votes per day and per month, and the top speakers and submitters
+    """
+    query = DailyStat.query.order_by(DailyStat.day)
+    if start is not None:
+        query = query.filter(DailyStat.day >= start.date(), DailyStat.day < end.date())
+
+    days = []
+    months = OrderedDict()
+    for row in query:
+        days.append({'day': row.day.isoformat(), 'quotes': row.quotes, 'votes': row.votes})
+        month = months.setdefault(row.day.strftime('%Y-%m'), {'month': row.day.strftime('%Y-%m'),
+                                                              'quotes': 0, 'votes': 0})
+        month['quotes'] += row.quotes
+        month['votes'] += row.votes
+
+    return {
+        'quotes': sum(day['quotes'] for day in days),
+        'votes': sum(day['votes'] for day in days),
+        'days': days,
+        'months': list(months.values()),
+        'speakers': _top(SpeakerStat, SpeakerStat.speaker, start, end, limit),
+        'submitters': _top(SubmitterStat, SubmitterStat.submitter, start, end, limit),
+    }
@@ -1,10 +1,19 @@
 from datetime import datetime, timedelta
 
 from functools import wraps
-from flask import session, jsonify
+from flask import session, jsonify, request, Response
+from sqlalchemy.exc import IntegrityError
 
-from quotefault_api.models import db, APIKey, Quote, Vote
+from quotefault_api import app
+from quotefault_api.models import db, APIKey, Quote, Vote, quote_fingerprint
 from quotefault_api.ldap import ldap_is_member
+from quotefault_api.events import bus
+from quotefault_api.index import quote_index, bump_revision
+from quotefault_api.stats import record_quote
+from quotefault_api.serialize import QUOTE_FIELDS, VOTE_FIELDS, parse_fields, http_date, encode_json, compress
+
+# Votes aren't tracked by the event stream, so don't query them for every event
+EVENT_FIELDS = tuple(field for field in QUOTE_FIELDS if field not in VOTE_FIELDS)
 
 
 def check_key(func):
@@ -38,33 +47,79 @@ def get_metadata() -> dict:
     return metadata
 
 
-def return_quote_json(quote: Quote, current_user=None):
+def return_quote_json(quote: Quote, current_user=None, fields=QUOTE_FIELDS):
     """
     Returns a Quote Object as JSON/Dict
     :param quote: The quote object being formatted
     :param current_user: The current user; used to determine whether that use voted on the quote
+    :param fields: The fields to include. Votes are only queried if 'votes' or 'direction' is requested.
     :return: Returns a dictionary of the quote object formatted to return as
     JSON
     """
-    votes = Vote.query.filter_by(quote_id=quote.id)
-    num_votes = sum(vote.direction
-                    if vote.quote_id == quote.id
-                    else 0 for vote in votes)
-    direction = 0
-    for vote in votes:
-        if vote.quote_id == quote.id and vote.voter == current_user:
-            direction = vote.direction
-
-    return {
+    quote_json = {
         'id': quote.id,
         'quote': quote.quote,
         'submitter': quote.submitter,
         'speaker': quote.speaker,
-        'quoteTime': quote.quote_time,
-        'votes': num_votes,
-        'direction': direction
+        'quoteTime': http_date(quote.quote_time),
     }
 
+    if any(field in fields for field in VOTE_FIELDS):
+        votes = Vote.query.filter_by(quote_id=quote.id).all()
+        quote_json['votes'] = sum(vote.direction for vote in votes)
+        quote_json['direction'] = 0
+        for vote in votes:
+            if vote.voter == current_user:
+                quote_json['direction'] = vote.direction
+
+    return {field: quote_json[field] for field in fields}
+
+
+def quote_committed(event: str, quote: Quote, revision: int):
+    """
+    Updates the quote index and tells streaming clients about a committed change to a quote
+    :param event: 'created' or 'updated'
+    :param quote: The quote that changed
+    :param revision: The revision bump_revision returned for the change
+    """
+    quote_index.put(quote, revision)
+    bus.publish(event, return_quote_json(quote, fields=EVENT_FIELDS))
+
+
+def quote_deleted(quote_id: int, revision: int):
+    """
+    Updates the quote index and tells streaming clients about a committed delete
+    :param quote_id: id of the deleted quote
+    :param revision: The revision bump_revision returned for the delete
+    """
+    quote_index.remove(quote_id, revision)
+    bus.publish('deleted', {'id': quote_id})
+
+
+def requested_fields() -> tuple:
+    """
+    :return: The fields asked for in the request's ?fields= parameter
+    """
+    return parse_fields(request.args.get('fields'))
+
+
+def json_response(obj, status=200) -> Response:
+    """
+    Builds a JSON response, using the fast encoder if enabled and gzipping large bodies
+    when the client accepts it
+    :param obj: A JSON-serialisable object
+    :param status: The HTTP status code
+    :return: The response
+    """
+    body = encode_json(obj, fast=app.config['FAST_JSON'])
+    response = Response(body, status=status, mimetype='application/json')
+    if len(body) >= app.config['GZIP_MIN_SIZE']:
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings['gzip']:
+            response.set_data(compress(body))
+            response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 
 def return_vote(vote: Vote) -> dict:
     return {
@@ -75,19 +130,20 @@ def return_vote(vote: Vote) -> dict:
     }
 
 
-def parse_as_json(quotes: list, quote_json=None, current_user=None) -> list:
+def parse_as_json(quotes: list, quote_json=None, current_user=None, fields=QUOTE_FIELDS) -> Response:
     """
     Builds a list of Quotes as JSON to be returned to the user requesting them
     :param quotes: List of Quote Objects
     :param quote_json: List of Quote Objects as dicts to return as JSON
     :param current_user: the currently logged in user
-    :return: Returns a list of Quote Objects as dicts to return as JSON
+    :param fields: the fields to include for each quote
+    :return: Returns a response with the list of Quote Objects as JSON
     """
     if quote_json is None:
         quote_json = []
     for quote in quotes:
-        quote_json.append(return_quote_json(quote, current_user=current_user))
-    return jsonify(quote_json)
+        quote_json.append(return_quote_json(quote, current_user=current_user, fields=fields))
+    return json_response(quote_json)
 
 
 def check_key_unique(owner: str, reason: str) -> bool:
@@ -111,6 +167,22 @@ def str_to_datetime(date: str) -> datetime:
     return datetime.strptime(date, str_format)
 
 
+def date_range(start: str, end: str) -> tuple:
+    """
+    Converts the date strings of a range to datetime objects
+    :param start: (optional, unless end provided) The date string for the start of the range.
+    If end is not provided, the range covers that single day
+    :param end: (optional) The date string for the end of the range.
+    :return: (start, end) as datetime objects, or (None, None) if start is None
+    """
+    if start is None:
+        return None, None
+    start = str_to_datetime(start)
+    if end is not None:
+        return start, str_to_datetime(end)
+    return start, start + timedelta(1)
+
+
 def query_builder(start: str, end: str, submitter: str, speaker: str, id_num=-1):
     """
     Builds a sqlalchemy query.
@@ -128,11 +200,7 @@ def query_builder(start: str, end: str, submitter: str, speaker: str, id_num=-1)
         return query.filter_by(id=id_num)
 
     if start is not None:
-        start = str_to_datetime(start)
-        if end is not None:
-            end = str_to_datetime(end)
-        else:
-            end = start + timedelta(1)
+        start, end = date_range(start, end)
         query = query.filter(Quote.quote_time.between(start, end))
 
     if submitter is not None:
@@ -144,6 +212,31 @@ def query_builder(start: str, end: str, submitter: str, speaker: str, id_num=-1)
     return query
 
 
+def find_quotes(start: str, end: str, submitter: str, speaker: str) -> list:
+    """
+    Finds the quotes matching the filters of query_builder, using the in-memory quote index
+    when QUOTE_INDEX is enabled
+    :return: The matching quotes
+    """
+    if app.config['QUOTE_INDEX']:
+        start, end = date_range(start, end)
+        return quote_index.find(start, end, submitter, speaker)
+    return query_builder(start, end, submitter, speaker).all()
+
+
+def is_duplicate(quote: str, quote_id=None) -> bool:
+    """
+    Checks whether a quote has already been submitted, ignoring case, punctuation and spacing
+    :param quote: The text of the quote
+    :param quote_id: (optional) The id of the quote being edited, which doesn't count as a duplicate
+    :return: True if another quote has the same fingerprint
+    """
+    query = Quote.query.filter_by(fingerprint=quote_fingerprint(quote))
+    if quote_id is not None:
+        query = query.filter(Quote.id != quote_id)
+    return query.first() is not None
+
+
 def flask_create_quote(submitter: str, speaker: str, quote: str):
     error = False
     error_message = ""
@@ -156,7 +249,7 @@ def flask_create_quote(submitter: str, speaker: str, quote: str):
     elif submitter == speaker:
         error = True
         error_message = "you can't quote yourself"
-    elif Quote.query.filter_by(quote=quote).first():
+    elif is_duplicate(quote):
         error = True
         error_message = "quote already exists"
     elif not ldap_is_member(speaker):
@@ -170,6 +263,15 @@ def flask_create_quote(submitter: str, speaker: str, quote: str):
                         'message': error_message}), 422
     new_quote = Quote(submitter, quote, speaker)
     db.session.add(new_quote)
-    db.session.flush()
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Someone else submitted the same quote since is_duplicate looked
+        db.session.rollback()
+        return jsonify({'status': 'error',
+                        'message': 'quote already exists'}), 422
+    record_quote(new_quote)
+    revision = bump_revision()
     db.session.commit()
+    quote_committed('created', new_quote, revision)
     return return_quote_json(new_quote), 201
@@ -0,0 +1,103 @@
+""" Quotefault - test_index.py
+Checks that the in-memory quote index finds the same quotes as the database does, on sqlite.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SPEAKERS = [None, 'alice', 'Alice', 'alice ', 'bob', 'zoë', 'nobody']
+SUBMITTERS = [None, 'carol', 'Carol', 'dave', 'nobody']
+RANGES = [(None, None), ('20190101', None), ('20190101', '20190301'), ('01-15-2019', '06-30-2019'),
+          ('20200101', None)]
+
+
+@pytest.fixture(scope='module')
+def app():
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database.close()
+    cwd = os.getcwd()
+    # config.env.py is read from the working directory, and login and LDAP need servers
+    os.chdir(_ROOT)
+    sys.path.insert(0, _ROOT)
+    with mock.patch.dict(os.environ, {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database.name}), \
+            mock.patch('flask_pyoidc.flask_pyoidc.OIDCAuthentication') as oidc, \
+            mock.patch('csh_ldap.CSHLDAP'):
+        oidc.return_value.oidc_auth.side_effect = lambda view: view
+        oidc.return_value.oidc_logout.side_effect = lambda view: view
+        from quotefault_api import app as quotefault
+    os.chdir(cwd)
+
+    from quotefault_api.models import db
+    with quotefault.app_context():
+        db.create_all()
+        yield quotefault
+        db.session.remove()
+    os.unlink(database.name)
+
+
+def _add(submitter, quote, speaker, when):
+    from quotefault_api.index import bump_revision
+    from quotefault_api.models import db, Quote
+    from quotefault_api.utils import quote_committed
+
+    row = Quote(submitter, quote, speaker)
+    row.quote_time = when
+    db.session.add(row)
+    db.session.flush()
+    revision = bump_revision()
+    db.session.commit()
+    quote_committed('created', row, revision)
+    return row
+
+
+def _assert_parity():
+    from quotefault_api.index import quote_index
+    from quotefault_api.utils import date_range, query_builder
+
+    for (start, end), submitter, speaker in itertools.product(RANGES, SUBMITTERS, SPEAKERS):
+        expected = [quote.id for quote in query_builder(start, end, submitter, speaker).all()]
+        found = [quote.id for quote in quote_index.find(*date_range(start, end), submitter, speaker)]
+        assert found == expected, (start, end, submitter, speaker)
+
+
+def test_index_matches_database(app):
+    from quotefault_api.index import bump_revision, quote_index
+    from quotefault_api.models import db
+    from quotefault_api.utils import quote_deleted
+
+    names = itertools.cycle(itertools.product(['carol', 'Carol', 'dave'], ['alice', 'Alice', 'alice ', 'bob', 'zoë']))
+    quotes = []
+    for day in range(120):
+        submitter, speaker = next(names)
+        when = datetime(2019, 1, 1 + day % 28, day % 24, 0, 0).replace(month=1 + day // 28)
+        quotes.append(_add(submitter, 'quote number {}'.format(day), speaker, when))
+    # Quotes on the last instant of a range are inside it
+    quotes.append(_add('carol', 'right on the end', 'alice', datetime(2019, 3, 1)))
+    _assert_parity()
+
+    # Writes made after the index was loaded
+    app.config['QUOTE_INDEX_PROBE_INTERVAL'] = 3600
+    _add('dave', 'a late one', 'bob', datetime(2019, 2, 2))
+    edited = quotes[3]
+    edited.speaker = 'bob'
+    db.session.flush()
+    revision = bump_revision()
+    db.session.commit()
+    quote_index.put(edited, revision)
+    for quote in quotes[10:80:3]:
+        db.session.delete(quote)
+        db.session.flush()
+        revision = bump_revision()
+        db.session.commit()
+        quote_deleted(quote.id, revision)
+    _assert_parity()